@@ -0,0 +1,32 @@
+"""
+OpenSquare Environment Bootstrap
+Loads the .env file at most once per process, however many entry points import it
+"""
+
+import os
+from dotenv import load_dotenv
+
+# Set after the first successful load
+_LOADED = False
+
+
+def ensure_env():
+    """
+    Load environment variables (only the first call does any work).
+    
+    Uses env_compiled.py from scripts/compile_env.py when present, otherwise
+    parses .env. Either way, variables already set in the environment win.
+    """
+    global _LOADED
+    if _LOADED:
+        return
+    
+    try:
+        import env_compiled
+    except ImportError:
+        load_dotenv()
+    else:
+        for name, value in vars(env_compiled).items():
+            if name.isupper():
+                os.environ.setdefault(name, value)
+    _LOADED = True
@@ -4,70 +4,135 @@ Complete backend API with Elasticsearch and Vertex AI
 Financial transparency platform using conversational AI
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import os
+import json
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 # Import configuration and utilities
-from config import Config
+from config import Config, CFG
 from utils import (
-    extract_text_from_pdf,
-    extract_data_from_excel,
-    extract_data_from_csv,
-    convert_dataframes_to_text,
+    extract_text,
     clean_text,
     chunk_text,
-    extract_amounts,
-    extract_dates,
+    bulk_index_chunks,
+    bulk_indexing_settings,
+    create_index_if_not_exists,
     format_file_size,
     generate_document_id,
-    validate_file_size
+    normalize_vector,
+    search_documents as search_chunks
+)
+from services import (
+    get_elastic_client,
+    get_embedding_model,
+    get_gemini_model,
+    get_redis_client
 )
 
-# Import Google Cloud libraries
-from google.cloud import storage
-from vertexai.generative_models import GenerativeModel
-import vertexai
+# Import Elasticsearch helpers
+from elasticsearch import helpers
 
-# Import Elasticsearch
-from elasticsearch import Elasticsearch
+# orjson is optional; Flask's stdlib JSON provider is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ============================================
 # APPLICATION INITIALIZATION
 # ============================================
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson (much faster on large responses)"""
+    
+    def dumps(self, obj, **kwargs):
+        # default handles what orjson can't natively (Decimal, UUID, __html__, ...)
+        return orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        ).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Create Flask application instance
 app = Flask(__name__)
 app.config.from_object(Config)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
 # Enable CORS for frontend communication
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-# Initialize Vertex AI (Google Cloud's AI platform)
-vertexai.init(
-    project=Config.GOOGLE_CLOUD_PROJECT,
-    location=Config.VERTEX_AI_LOCATION
-)
+# Static instructions sent once as the system instruction, so each request
+# only carries the retrieved context and the user question
+SYSTEM_PROMPT = """You are OpenSquare AI, a financial transparency assistant.
+
+INSTRUCTIONS:
+1. Answer ONLY using provided documents
+2. Cite sources (e.g., "According to Document 1...")
+3. Highlight suspicious patterns or red flags
+4. Be concise (2-3 paragraphs)
+5. Use bullet points for key findings"""
 
-# Initialize Gemini model for conversational AI
-gemini_model = GenerativeModel(Config.VERTEX_AI_MODEL)
+# Fixed pieces of the per-request RAG prompt
+CONTEXT_HEADER = "Here are relevant documents:\n\n"
+PROMPT_FOOTER = "\n\nANSWER:"
 
-# Initialize Elasticsearch client for document search
-elastic_client = Elasticsearch(
-    cloud_id=Config.ELASTIC_CLOUD_ID,
-    api_key=Config.ELASTIC_API_KEY
-)
+# Gemini sampling settings shared by normal and streamed answers
+GENERATION_CONFIG = {
+    'temperature': CFG.AI_TEMPERATURE,
+    'max_output_tokens': CFG.AI_MAX_OUTPUT_TOKENS,
+}
+
+# Fallback answer returned (and never cached) when Gemini fails
+AI_ERROR_MESSAGE = "I encountered an error processing your request."
+
+# Thread pool for overlapping blocking network calls (Vertex AI, Elastic)
+io_executor = ThreadPoolExecutor(max_workers=CFG.IO_MAX_WORKERS)
+
+# Worker pool for background document ingestion (kept apart from
+# io_executor because ingestion itself fans out onto io_executor)
+ingest_executor = ThreadPoolExecutor(max_workers=CFG.INGEST_MAX_WORKERS)
+
+# Slots for background uploads held in memory (queued or running)
+_ingest_slots = threading.BoundedSemaphore(CFG.MAX_PENDING_INGESTS)
 
-# Initialize Google Cloud Storage for file uploads
-storage_client = storage.Client(project=Config.GOOGLE_CLOUD_PROJECT)
+# Background upload status when Redis is not configured, as
+# doc_id -> (monotonic write time, status), oldest write first
+_upload_status: Dict[str, tuple] = {}
+_upload_status_lock = threading.Lock()
+
+# Set once the chunks index has been created or found
+_chunks_index_ready = False
+
+# Last Elasticsearch health probe as (monotonic time, online)
+_elastic_health = None
+
+# Fields returned by keyword search; 'content' is added only for RAG
+SEARCH_SOURCE_FIELDS = ["title", "organization", "doc_type", "year"]
+
+# Trim search responses to the parts the API actually returns
+SEARCH_FILTER_PATH = [
+    "hits.hits._id",
+    "hits.hits._score",
+    "hits.hits._source",
+    "hits.hits.highlight"
+]
 
-# Create upload folder for temporary file storage
-UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Config never changes after startup, so summarize it once
+CONFIG_SUMMARY = Config.get_config_summary()
 
 
 # ============================================
@@ -96,11 +161,86 @@ SAMPLE_DOCUMENTS = [
 # HELPER FUNCTIONS
 # ============================================
 
+def make_cache_key(prefix: str, *parts: str) -> str:
+    """Build a Redis key from a prefix and a hash of the normalized parts"""
+    normalized = "|".join(part.lower().strip() for part in parts)
+    return f"{prefix}:{hashlib.sha256(normalized.encode()).hexdigest()}"
+
+
+def get_cached(key: str) -> Optional[Any]:
+    """Read a JSON value from the Redis cache (None on miss or when disabled)"""
+    redis_client = get_redis_client()
+    if redis_client is None:
+        return None
+    try:
+        cached = redis_client.get(key)
+        return json.loads(cached) if cached is not None else None
+    except Exception as e:
+        print(f"Error reading cache: {str(e)}")
+        return None
+
+
+def set_cached(key: str, value: Any, ttl: int):
+    """Store a JSON value in the Redis cache for ttl seconds"""
+    redis_client = get_redis_client()
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(key, ttl, json.dumps(value))
+    except Exception as e:
+        print(f"Error writing cache: {str(e)}")
+
+
+def invalidate_cache():
+    """Drop cached search results and answers after the index changes"""
+    redis_client = get_redis_client()
+    if redis_client is None:
+        return
+    try:
+        for pattern in ("search:*", "chat:*"):
+            keys = list(redis_client.scan_iter(match=pattern, count=500))
+            if keys:
+                redis_client.delete(*keys)
+    except Exception as e:
+        print(f"Error invalidating cache: {str(e)}")
+
+
+def ensure_chunks_index() -> bool:
+    """Create the chunks index with its dense_vector mapping on first use"""
+    global _chunks_index_ready
+    if not _chunks_index_ready:
+        _chunks_index_ready = create_index_if_not_exists(
+            get_elastic_client(), CFG.ELASTIC_CHUNKS_INDEX
+        )
+    return _chunks_index_ready
+
+
+def get_hits(response) -> List[Dict]:
+    """Hits from a search response (filter_path drops 'hits' when empty)"""
+    return response.body.get('hits', {}).get('hits', [])
+
+
+def is_elastic_online() -> bool:
+    """Check Elasticsearch, reusing the result for HEALTH_CACHE_TTL seconds"""
+    global _elastic_health
+    now = time.monotonic()
+    if _elastic_health is not None and now - _elastic_health[0] < CFG.HEALTH_CACHE_TTL:
+        return _elastic_health[1]
+    
+    try:
+        online = get_elastic_client().info() is not None
+    except Exception:
+        online = False
+    
+    _elastic_health = (now, online)
+    return online
+
+
 def index_document_to_elastic(doc_id: str, content: Dict[str, Any]) -> bool:
     """Index a document in Elasticsearch"""
     try:
-        response = elastic_client.index(
-            index=Config.ELASTIC_INDEX_NAME,
+        response = get_elastic_client().index(
+            index=CFG.ELASTIC_INDEX_NAME,
             id=doc_id,
             document=content
         )
@@ -110,11 +250,86 @@ def index_document_to_elastic(doc_id: str, content: Dict[str, Any]) -> bool:
         return False
 
 
-def search_documents(query: str, size: int = 5) -> List[Dict]:
-    """Search documents using Elasticsearch"""
+def get_cached_embeddings(keys: List[str]) -> Dict[str, List[float]]:
+    """Look up previously computed embeddings in Redis (empty when disabled)"""
+    redis_client = get_redis_client()
+    if redis_client is None or not keys:
+        return {}
+    try:
+        return {
+            key: json.loads(value)
+            for key, value in zip(keys, redis_client.mget(keys))
+            if value is not None
+        }
+    except Exception as e:
+        print(f"Error reading embedding cache: {str(e)}")
+        return {}
+
+
+def set_cached_embeddings(vectors_by_key: Dict[str, List[float]]):
+    """Store new embeddings in Redis with one pipelined round-trip"""
+    redis_client = get_redis_client()
+    if redis_client is None or not vectors_by_key:
+        return
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for key, vector in vectors_by_key.items():
+            pipeline.setex(key, CFG.EMBEDDING_CACHE_TTL, json.dumps(vector))
+        pipeline.execute()
+    except Exception as e:
+        print(f"Error writing embedding cache: {str(e)}")
+
+
+def get_embeddings_batch(texts: List[str]) -> List[List[float]]:
+    """
+    Embed many texts with as few Vertex AI requests as possible (unit-length vectors)
+    Identical texts (e.g. repeated page headers) are embedded only once, and
+    embeddings are reused across uploads through Redis when it is enabled
+    """
+    try:
+        # Key each text by content hash; dict keeps one text per key
+        keys = [
+            f"embedding:{CFG.VERTEX_AI_EMBEDDING_MODEL}:"
+            + hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+            for text in texts
+        ]
+        unique_texts = dict(zip(keys, texts))
+        vectors_by_key = get_cached_embeddings(list(unique_texts))
+        
+        missing_keys = [key for key in unique_texts if key not in vectors_by_key]
+        batches = [
+            [unique_texts[key] for key in missing_keys[i:i + CFG.EMBEDDING_BATCH_SIZE]]
+            for i in range(0, len(missing_keys), CFG.EMBEDDING_BATCH_SIZE)
+        ]
+        # Batches are sent concurrently; map() keeps them in order
+        new_vectors = []
+        for embeddings in io_executor.map(get_embedding_model().get_embeddings, batches):
+            new_vectors.extend(normalize_vector(embedding.values) for embedding in embeddings)
+        
+        new_by_key = dict(zip(missing_keys, new_vectors))
+        vectors_by_key.update(new_by_key)
+        set_cached_embeddings(new_by_key)
+        
+        return [vectors_by_key[key] for key in keys]
+    except Exception as e:
+        print(f"Error generating embeddings: {str(e)}")
+        return []
+
+
+def search_documents(query: str, size: int = 5, include_content: bool = False) -> List[Dict]:
+    """
+    Search documents using Elasticsearch (results cached in Redis)
+    Full document content is only fetched when include_content is set
+    """
+    source_fields = SEARCH_SOURCE_FIELDS + ["content"] if include_content else SEARCH_SOURCE_FIELDS
+    cache_key = make_cache_key("search", query, str(size), str(include_content))
+    cached = get_cached(cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        response = elastic_client.search(
-            index=Config.ELASTIC_INDEX_NAME,
+        response = get_elastic_client().search(
+            index=CFG.ELASTIC_INDEX_NAME,
             body={
                 "query": {
                     "multi_match": {
@@ -128,11 +343,13 @@ def search_documents(query: str, size: int = 5) -> List[Dict]:
                 "highlight": {
                     "fields": {"content": {"number_of_fragments": 3}}
                 }
-            }
+            },
+            source_includes=source_fields,
+            filter_path=SEARCH_FILTER_PATH
         )
         
         results = []
-        for hit in response['hits']['hits']:
+        for hit in get_hits(response):
             results.append({
                 'id': hit['_id'],
                 'score': hit['_score'],
@@ -140,62 +357,106 @@ def search_documents(query: str, size: int = 5) -> List[Dict]:
                 'highlights': hit.get('highlight', {})
             })
         
+        if results:
+            set_cached(cache_key, results, CFG.SEARCH_CACHE_TTL)
+        
         return results
     except Exception as e:
         print(f"Error searching Elastic: {str(e)}")
         return []
 
 
+def build_rag_prompt(query: str, context_docs: List[Dict]) -> str:
+    """Build the per-request Gemini prompt from the matched documents"""
+    # Build context from documents in a single join
+    context = CONTEXT_HEADER + "".join(
+        f"Document {i}: {doc['source'].get('title', 'Untitled')}\n"
+        f"Organization: {doc['source'].get('organization', 'Unknown')}\n"
+        f"Content: {doc['source'].get('content', '')[:500]}...\n\n"
+        for i, doc in enumerate(context_docs, 1)
+    )
+    
+    # Instructions live in SYSTEM_PROMPT
+    return f"CONTEXT:\n{context}\n\nUSER QUESTION: {query}{PROMPT_FOOTER}"
+
+
 def generate_ai_response(query: str, context_docs: List[Dict]) -> str:
     """Generate AI response using Gemini with RAG"""
     try:
-        # Build context from documents
-        context = "Here are relevant documents:\n\n"
-        
-        for i, doc in enumerate(context_docs, 1):
-            source = doc['source']
-            context += f"Document {i}: {source.get('title', 'Untitled')}\n"
-            context += f"Organization: {source.get('organization', 'Unknown')}\n"
-            context += f"Content: {source.get('content', '')[:500]}...\n\n"
+        response = get_gemini_model(SYSTEM_PROMPT).generate_content(
+            build_rag_prompt(query, context_docs),
+            generation_config=GENERATION_CONFIG
+        )
         
-        # Create prompt for Gemini
-        prompt = f"""You are OpenSquare AI, a financial transparency assistant.
+        return response.text
+    except Exception as e:
+        print(f"Error generating AI response: {str(e)}")
+        return AI_ERROR_MESSAGE
 
-CONTEXT:
-{context}
 
-USER QUESTION: {query}
+def stream_chat_events(query: str, context_docs: List[Dict], sources: List[Dict],
+                       cache_key: str, cached_answer: Optional[str]):
+    """
+    Server-sent events for /api/chat in stream mode
+    Sends sources first, then answer text as Gemini produces it
+    """
+    yield f"data: {json.dumps({'sources': sources, 'query': query})}\n\n"
+    
+    if cached_answer is not None:
+        yield f"data: {json.dumps({'text': cached_answer})}\n\n"
+    else:
+        try:
+            parts = []
+            response = get_gemini_model(SYSTEM_PROMPT).generate_content(
+                build_rag_prompt(query, context_docs),
+                generation_config=GENERATION_CONFIG,
+                stream=True
+            )
+            for chunk in response:
+                parts.append(chunk.text)
+                yield f"data: {json.dumps({'text': parts[-1]})}\n\n"
+            # Only complete, non-empty answers are cached (an error above skips this,
+            # and a stream whose chunks were all blocked yields no text)
+            answer = "".join(parts)
+            if answer:
+                set_cached(cache_key, answer, CFG.ANSWER_CACHE_TTL)
+        except Exception as e:
+            print(f"Error streaming AI response: {str(e)}")
+            yield f"data: {json.dumps({'error': AI_ERROR_MESSAGE})}\n\n"
+    
+    yield f"data: {json.dumps({'done': True})}\n\n"
 
-INSTRUCTIONS:
-1. Answer ONLY using provided documents
-2. Cite sources (e.g., "According to Document 1...")
-3. Highlight suspicious patterns or red flags
-4. Be concise (2-3 paragraphs)
-5. Use bullet points for key findings
 
-ANSWER:"""
-        
-        # Generate response
-        response = gemini_model.generate_content(
-            prompt,
-            generation_config={
-                'temperature': Config.AI_TEMPERATURE,
-                'max_output_tokens': Config.AI_MAX_OUTPUT_TOKENS,
-            }
+def bulk_index_to_elastic(actions, chunk_size: int = 500) -> int:
+    """Index many documents in Elasticsearch with batched _bulk requests"""
+    try:
+        success, errors = helpers.bulk(
+            get_elastic_client(),
+            actions,
+            chunk_size=chunk_size,
+            request_timeout=60,
+            raise_on_error=False
         )
-        
-        return response.text
+        if errors:
+            print(f"Error indexing {len(errors)} documents to Elastic")
+        return success
     except Exception as e:
-        print(f"Error generating AI response: {str(e)}")
-        return "I encountered an error processing your request."
+        print(f"Error bulk indexing to Elastic: {str(e)}")
+        return 0
 
 
 def load_sample_documents():
     """Load sample documents into Elasticsearch"""
     try:
-        for i, doc in enumerate(SAMPLE_DOCUMENTS):
-            doc_id = f"sample_doc_{i}"
-            index_document_to_elastic(doc_id, doc)
+        actions = (
+            {
+                "_index": CFG.ELASTIC_INDEX_NAME,
+                "_id": f"sample_doc_{i}",
+                "_source": doc
+            }
+            for i, doc in enumerate(SAMPLE_DOCUMENTS)
+        )
+        bulk_index_to_elastic(actions)
         print("✅ Sample documents loaded")
         return True
     except Exception as e:
@@ -203,6 +464,128 @@ def load_sample_documents():
         return False
 
 
+def ingest_document(doc_id: str, file_bytes: bytes, filename: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extract, index, chunk and embed an uploaded document
+    Returns the upload API response body
+    """
+    file_size = len(file_bytes)
+    organization = metadata['organization']
+    year = metadata['year']
+    
+    # Extract content based on file type (CPU-bound, so it runs in a worker process)
+    file_ext = filename.rsplit('.', 1)[1].lower()
+    try:
+        raw_content = extract_text(file_bytes, file_ext, timeout=CFG.EXTRACTION_TIMEOUT)
+    except FutureTimeoutError:
+        return {'status': 'error', 'message': 'Extraction timed out'}
+    except BrokenProcessPool:
+        return {'status': 'error', 'message': 'Extraction failed: the file crashed the extractor'}
+    
+    # Clean content
+    content = clean_text(raw_content)
+    
+    # Create document
+    document = {
+        'title': filename,
+        'content': content,
+        'organization': organization,
+        'doc_type': metadata['doc_type'],
+        'year': year,
+        'uploaded_at': metadata['uploaded_at'],
+        'file_size': file_size
+    }
+    
+    # Index in Elasticsearch
+    if not index_document_to_elastic(doc_id, document):
+        return {'status': 'error', 'message': 'Failed to index document'}
+    invalidate_cache()
+    
+    # Chunk the raw text (clean_text collapses the blank lines that separate
+    # paragraphs), then clean each chunk and embed it (one request per batch)
+    chunks = [
+        {**chunk, 'text': text}
+        for chunk in chunk_text(raw_content, doc_id, filename, '', metadata['uploaded_at'])
+        if (text := clean_text(chunk['text']))
+    ]
+    vectors = get_embeddings_batch([chunk['text'] for chunk in chunks])
+    if len(vectors) != len(chunks):
+        # The document is keyword-searchable, but /api/query can't find it yet
+        return {
+            'status': 'error',
+            'message': 'Failed to embed document chunks; please retry the upload',
+            'document_id': doc_id
+        }
+    embedded_chunks = [
+        {**chunk, 'organization': organization, 'year': year, 'vector': vector}
+        for chunk, vector in zip(chunks, vectors)
+    ]
+    indexed_chunks = 0
+    if embedded_chunks:
+        if not ensure_chunks_index():
+            return {'status': 'error', 'message': 'Failed to create chunks index', 'document_id': doc_id}
+        if len(embedded_chunks) >= CFG.BULK_TUNING_MIN_ACTIONS:
+            with bulk_indexing_settings(get_elastic_client(), CFG.ELASTIC_CHUNKS_INDEX):
+                indexed_chunks = bulk_index_chunks(get_elastic_client(), embedded_chunks)
+        else:
+            indexed_chunks = bulk_index_chunks(get_elastic_client(), embedded_chunks)
+    
+    if indexed_chunks < len(embedded_chunks):
+        return {
+            'status': 'error',
+            'message': f'Indexed only {indexed_chunks} of {len(embedded_chunks)} chunks; please retry the upload',
+            'document_id': doc_id
+        }
+    
+    return {
+        'status': 'success',
+        'message': 'Document processed successfully',
+        'document_id': doc_id,
+        'filename': filename,
+        'size': format_file_size(file_size),
+        'organization': organization,
+        'chunks': indexed_chunks
+    }
+
+
+def set_upload_status(doc_id: str, status: Dict[str, Any]):
+    """Record background upload status (Redis when enabled, else in-process)"""
+    if get_redis_client() is None:
+        now = time.monotonic()
+        with _upload_status_lock:
+            # Re-insert to keep write order, then drop entries past UPLOAD_STATUS_TTL
+            _upload_status.pop(doc_id, None)
+            _upload_status[doc_id] = (now, status)
+            while True:
+                oldest = next(iter(_upload_status))
+                if now - _upload_status[oldest][0] < CFG.UPLOAD_STATUS_TTL:
+                    break
+                del _upload_status[oldest]
+    else:
+        set_cached(f"upload:{doc_id}", status, CFG.UPLOAD_STATUS_TTL)
+
+
+def get_upload_status(doc_id: str) -> Optional[Dict[str, Any]]:
+    """Look up background upload status (None if unknown)"""
+    if get_redis_client() is None:
+        entry = _upload_status.get(doc_id)
+        if entry is None or time.monotonic() - entry[0] >= CFG.UPLOAD_STATUS_TTL:
+            return None
+        return entry[1]
+    return get_cached(f"upload:{doc_id}")
+
+
+def ingest_document_in_background(doc_id: str, file_bytes: bytes, filename: str, metadata: Dict[str, Any]):
+    """Run ingest_document on the ingest pool and record the outcome"""
+    try:
+        result = ingest_document(doc_id, file_bytes, filename, metadata)
+    except Exception as e:
+        result = {'status': 'error', 'message': f'Error: {str(e)}'}
+    finally:
+        _ingest_slots.release()
+    set_upload_status(doc_id, {**result, 'document_id': doc_id})
+
+
 # ============================================
 # API ENDPOINTS - HEALTH & STATUS
 # ============================================
@@ -214,18 +597,14 @@ def home():
         'status': 'success',
         'message': 'OpenSquare API is running',
         'version': '1.0.0',
-        'environment': Config.FLASK_ENV
+        'environment': CFG.FLASK_ENV
     })
 
 
 @app.route('/api/health')
 def health():
     """Detailed health check"""
-    try:
-        elastic_health = elastic_client.info()
-        elastic_ok = elastic_health is not None
-    except:
-        elastic_ok = False
+    elastic_ok = is_elastic_online()
     
     return jsonify({
         'status': 'success',
@@ -234,14 +613,14 @@ def health():
             'elasticsearch': 'online' if elastic_ok else 'offline',
             'vertex_ai': 'online'
         },
-        'timestamp': datetime.now().isoformat()
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
     })
 
 
 @app.route('/api/config')
 def get_config():
     """Get configuration summary (no sensitive data)"""
-    return jsonify(Config.get_config_summary())
+    return jsonify(CONFIG_SUMMARY)
 
 
 # ============================================
@@ -255,6 +634,10 @@ def upload_document():
     Accepts: PDF, Excel, CSV
     """
     try:
+        # Reject oversized uploads before reading the request body
+        if request.content_length and request.content_length > CFG.MAX_CONTENT_LENGTH:
+            return jsonify({'status': 'error', 'message': 'File exceeds 50MB limit'}), 400
+        
         # Validate file provided
         if 'file' not in request.files:
             return jsonify({'status': 'error', 'message': 'No file provided'}), 400
@@ -268,88 +651,77 @@ def upload_document():
         if not Config.allowed_file(file.filename):
             return jsonify({
                 'status': 'error',
-                'message': f'File type not allowed. Supported: {", ".join(Config.ALLOWED_EXTENSIONS)}'
+                'message': f'File type not allowed. Supported: {", ".join(CFG.ALLOWED_EXTENSIONS)}'
             }), 400
         
-        # Save file with unique name
+        # Read the upload once into memory (no temporary file on disk)
         filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        unique_filename = f"{timestamp}_{filename}"
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(file_path)
-        
-        # Validate file size
-        file_size = os.path.getsize(file_path)
-        if file_size > Config.MAX_CONTENT_LENGTH:
-            os.remove(file_path)
-            return jsonify({'status': 'error', 'message': 'File exceeds 50MB limit'}), 400
+        file_bytes = file.read()
         
-        # Extract content based on file type
-        file_ext = filename.rsplit('.', 1)[1].lower()
-        
-        if file_ext == 'pdf':
-            content = extract_text_from_pdf(file_path)
-        elif file_ext in ['xlsx', 'xls']:
-            sheets = extract_data_from_excel(file_path)
-            content = convert_dataframes_to_text(sheets)
-        elif file_ext == 'csv':
-            df = extract_data_from_csv(file_path)
-            content = df.to_string()
-        else:
-            content = ""
-        
-        # Clean content
-        content = clean_text(content)
-        
-        # Get metadata
-        organization = request.form.get('organization', 'Unknown')
-        doc_type = request.form.get('doc_type', 'General')
-        year = request.form.get('year', datetime.now().year)
-        
-        # Create document
-        doc_id = generate_document_id(filename, datetime.now().isoformat())
-        document = {
-            'title': filename,
-            'content': content,
-            'organization': organization,
-            'doc_type': doc_type,
-            'year': year,
-            'uploaded_at': datetime.now().isoformat(),
-            'file_size': file_size
+        # Get metadata (one clock read for the ID and all timestamps)
+        now = datetime.now()
+        metadata = {
+            'organization': request.form.get('organization', 'Unknown'),
+            'doc_type': request.form.get('doc_type', 'General'),
+            'year': request.form.get('year', now.year),
+            'uploaded_at': now.isoformat()
         }
+        doc_id = generate_document_id(filename, metadata['uploaded_at'])
         
-        # Index in Elasticsearch
-        if not index_document_to_elastic(doc_id, document):
-            os.remove(file_path)
-            return jsonify({'status': 'error', 'message': 'Failed to index document'}), 500
-        
-        # Clean up local file
-        os.remove(file_path)
+        # Background mode: return immediately, poll /api/upload/status/<id>
+        if request.form.get('async', 'false').lower() == 'true':
+            # Without Redis, status is kept per process, so a poll could reach
+            # a different gunicorn worker than the one running the upload
+            if get_redis_client() is None and Config.is_production():
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Background uploads require REDIS_URL in production'
+                }), 400
+            # Bound the uploads waiting in memory; callers retry later when full
+            if not _ingest_slots.acquire(blocking=False):
+                response = jsonify({
+                    'status': 'error',
+                    'message': 'Too many uploads in progress, please retry shortly'
+                })
+                response.headers['Retry-After'] = '30'
+                return response, 503
+            try:
+                set_upload_status(doc_id, {'status': 'processing', 'document_id': doc_id})
+                ingest_executor.submit(ingest_document_in_background, doc_id, file_bytes, filename, metadata)
+            except Exception:
+                _ingest_slots.release()
+                raise
+            return jsonify({'status': 'processing', 'document_id': doc_id}), 202
         
-        return jsonify({
-            'status': 'success',
-            'message': 'Document processed successfully',
-            'document_id': doc_id,
-            'filename': filename,
-            'size': format_file_size(file_size),
-            'organization': organization
-        })
+        result = ingest_document(doc_id, file_bytes, filename, metadata)
+        return jsonify(result), (200 if result['status'] == 'success' else 500)
     
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error: {str(e)}'}), 500
 
 
+@app.route('/api/upload/status/<document_id>', methods=['GET'])
+def upload_status(document_id):
+    """Processing status of a document uploaded in background mode"""
+    status = get_upload_status(document_id)
+    if status is None:
+        return jsonify({'status': 'error', 'message': 'Unknown document'}), 404
+    return jsonify(status)
+
+
 @app.route('/api/documents', methods=['GET'])
 def list_documents():
     """List all indexed documents"""
     try:
-        response = elastic_client.search(
-            index=Config.ELASTIC_INDEX_NAME,
-            body={"query": {"match_all": {}}, "size": 100}
+        response = get_elastic_client().search(
+            index=CFG.ELASTIC_INDEX_NAME,
+            body={"query": {"match_all": {}}, "size": 100},
+            source_excludes=["content"],
+            filter_path=["hits.hits._id", "hits.hits._source"]
         )
         
         documents = []
-        for hit in response['hits']['hits']:
+        for hit in get_hits(response):
             doc = hit['_source']
             doc['id'] = hit['_id']
             documents.append(doc)
@@ -381,7 +753,7 @@ def chat():
             return jsonify({'status': 'error', 'message': 'No query provided'}), 400
         
         # Search for relevant documents
-        search_results = search_documents(query, size=Config.RAG_TOP_K)
+        search_results = search_documents(query, size=CFG.RAG_TOP_K, include_content=True)
         
         if not search_results:
             return jsonify({
@@ -391,9 +763,6 @@ def chat():
                 'query': query
             })
         
-        # Generate AI response
-        answer = generate_ai_response(query, search_results)
-        
         # Format sources
         sources = []
         for result in search_results:
@@ -405,6 +774,95 @@ def chat():
                 'relevance_score': round(result['score'], 2)
             })
         
+        # Answers are cached per query and set of matched documents
+        cache_key = make_cache_key(
+            "chat", query, *sorted(result['id'] for result in search_results)
+        )
+        answer = get_cached(cache_key)
+        cache_hit = answer is not None
+        
+        # Stream mode: send the answer as server-sent events while it generates
+        if data.get('stream'):
+            response = Response(
+                stream_with_context(
+                    stream_chat_events(query, search_results, sources, cache_key, answer)
+                ),
+                mimetype='text/event-stream'
+            )
+            response.headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+            return response
+        
+        # Generate AI response
+        if not cache_hit:
+            answer = generate_ai_response(query, search_results)
+            if answer != AI_ERROR_MESSAGE:
+                set_cached(cache_key, answer, CFG.ANSWER_CACHE_TTL)
+        
+        response = jsonify({
+            'status': 'success',
+            'answer': answer,
+            'sources': sources,
+            'query': query
+        })
+        response.headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+        return response
+    
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/query', methods=['POST'])
+def query_documents():
+    """
+    Semantic (RAG) query over uploaded document chunks
+    Optional filters narrow the kNN search: {"organization": ..., "year": ...}
+    """
+    try:
+        data = request.get_json()
+        query = data.get('query', '')
+        filters = data.get('filters') or {}
+        
+        if not query:
+            return jsonify({'status': 'error', 'message': 'No query provided'}), 400
+        
+        # Embed the question and find the closest chunks
+        query_vectors = get_embeddings_batch([query])
+        if not query_vectors:
+            return jsonify({'status': 'error', 'message': 'Failed to embed query'}), 500
+        
+        search_results = search_chunks(
+            get_elastic_client(), query_vectors[0], size=CFG.RAG_TOP_K, filters=filters
+        )
+        
+        if not search_results:
+            return jsonify({
+                'status': 'success',
+                'answer': 'I couldn\'t find relevant documents. Please upload documents or try a different query.',
+                'sources': [],
+                'query': query
+            })
+        
+        # Generate AI response from the matched chunks
+        context_docs = [
+            {
+                'source': {
+                    'title': result['source_filename'],
+                    'organization': result.get('organization', 'Unknown'),
+                    'content': result['text']
+                }
+            }
+            for result in search_results
+        ]
+        answer = generate_ai_response(query, context_docs)
+        
+        # List each source file once, in ranking order
+        sources = [
+            {'filename': filename, 'url': url}
+            for filename, url in dict.fromkeys(
+                (result['source_filename'], result['source_url']) for result in search_results
+            )
+        ]
+        
         return jsonify({
             'status': 'success',
             'answer': answer,
@@ -448,6 +906,7 @@ def initialize():
     """Load sample documents for demo"""
     try:
         load_sample_documents()
+        invalidate_cache()
         return jsonify({
             'status': 'success',
             'message': 'Sample documents loaded successfully'
@@ -460,23 +919,18 @@ def initialize():
 # ERROR HANDLERS
 # ============================================
 
+# Static error bodies are serialized once at import
+NOT_FOUND_BODY = json.dumps({'status': 'error', 'message': 'Endpoint not found'})
+INTERNAL_ERROR_BODY = json.dumps({'status': 'error', 'message': 'Internal server error'})
+
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
-    return jsonify({
-        'status': 'error',
-        'message': 'Endpoint not found'
-    }), 404
+    return Response(NOT_FOUND_BODY, status=404, mimetype='application/json')
 
 
 @app.errorhandler(500)
 def internal_error(error):
     """Handle 500 errors"""
-    return jsonify({
-        'status': 'error',
-        'message': 'Internal server error'
-    }), 500
-
-
-if __name__ == '__main__':
-    app.run(debug=True)
+    return Response(INTERNAL_ERROR_BODY, status=500, mimetype='application/json')
@@ -5,12 +5,64 @@ Load from .env file for security
 """
 
 import os
-from dotenv import load_dotenv
+from types import SimpleNamespace
+from _env_bootstrap import ensure_env
 
 # Load environment variables from .env file
-load_dotenv()
+ensure_env()
 
-class Config:
+
+def _available_cpus() -> int:
+    """CPUs this process may run on (respects CPU affinity, unlike os.cpu_count)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _default_bucket_name():
+    """
+    STORAGE_BUCKET_NAME, else '<GOOGLE_CLOUD_PROJECT>-documents'.
+    Returns None when neither is set (never a bogus 'None-documents' bucket).
+    """
+    bucket = os.getenv('STORAGE_BUCKET_NAME')
+    if bucket:
+        return bucket
+    project = Config.GOOGLE_CLOUD_PROJECT
+    return f'{project}-documents' if project else None
+
+
+# Rarely used settings, read from the environment on first access instead of
+# at import (see LazyEnvConfig). Each value is a zero-argument loader.
+LAZY_SETTINGS = {
+    # Cloud Storage bucket for uploaded documents
+    # Format: project-id-documents
+    'STORAGE_BUCKET_NAME': _default_bucket_name,
+    
+    # SendGrid API key (optional, for email alerts)
+    # Only needed if EMAIL_ENABLED = True
+    'SENDGRID_API_KEY': lambda: os.getenv('SENDGRID_API_KEY'),
+    
+    # Default sender email for notifications
+    'FROM_EMAIL': lambda: os.getenv('FROM_EMAIL', 'noreply@opensquare.app'),
+}
+
+
+class LazyEnvConfig(type):
+    """
+    Metaclass that resolves LAZY_SETTINGS on first attribute access.
+    The loaded value is stored on the class, so each one is read only once.
+    """
+    
+    def __getattr__(cls, name):
+        loader = LAZY_SETTINGS.get(name)
+        if loader is None:
+            raise AttributeError(f"type object '{cls.__name__}' has no attribute '{name}'")
+        value = loader()
+        setattr(cls, name, value)
+        return value
+
+
+class Config(metaclass=LazyEnvConfig):
     """
     Configuration class that holds all application settings.
     Values are loaded from environment variables for security.
@@ -36,9 +88,11 @@ class Config:
     # Vertex AI model name (which LLM to use)
     VERTEX_AI_MODEL = os.getenv('VERTEX_AI_MODEL', 'gemini-1.5-pro')
     
-    # Cloud Storage bucket for uploaded documents
-    # Format: project-id-documents
-    STORAGE_BUCKET_NAME = os.getenv('STORAGE_BUCKET_NAME', f'{GOOGLE_CLOUD_PROJECT}-documents')
+    # Vertex AI embedding model (turns text chunks into vectors for RAG)
+    # text-embedding-004 returns 768-dimensional vectors
+    VERTEX_AI_EMBEDDING_MODEL = os.getenv('VERTEX_AI_EMBEDDING_MODEL', 'text-embedding-004')
+    
+    # STORAGE_BUCKET_NAME is loaded lazily (see LAZY_SETTINGS)
     
     # ============================================
     # ELASTIC CONFIGURATION
@@ -63,6 +117,9 @@ class Config:
     # Alerts index for monitoring watchlists
     ELASTIC_ALERTS_INDEX = os.getenv('ELASTIC_ALERTS_INDEX', 'opensquare-alerts')
     
+    # Chunks index holding embedded text chunks for semantic search (RAG)
+    ELASTIC_CHUNKS_INDEX = os.getenv('ELASTIC_CHUNKS_INDEX', 'opensquare-chunks')
+    
     # ============================================
     # APPLICATION SETTINGS
     # ============================================
@@ -79,6 +136,11 @@ class Config:
     # Change this in production!
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     
+    # Gunicorn worker processes when running in production
+    # Set this to the container's CPU quota (e.g. on Cloud Run);
+    # defaults to the CPUs available to this process
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY') or _available_cpus())
+    
     # Maximum file upload size (50MB in bytes)
     # 50 * 1024 * 1024 = 52,428,800 bytes
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024
@@ -87,6 +149,9 @@ class Config:
     # Only these file types can be uploaded
     ALLOWED_EXTENSIONS = {'pdf', 'xlsx', 'xls', 'csv'}
     
+    # Same extensions with their dot, for a single suffix lookup in allowed_file
+    _ALLOWED_DOT_EXT = frozenset('.' + ext for ext in ALLOWED_EXTENSIONS)
+    
     # ============================================
     # AI CONFIGURATION
     # ============================================
@@ -106,6 +171,58 @@ class Config:
     # Gets top K documents to use as context for AI
     RAG_TOP_K = int(os.getenv('RAG_TOP_K', '5'))
     
+    # Number of chunks sent per embedding request
+    # Vertex AI caps a request at 250 texts and 20,000 tokens,
+    # so ~1500-char chunks must be sent in smaller groups
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+    
+    # Worker threads for concurrent network calls (embedding batches etc.)
+    IO_MAX_WORKERS = int(os.getenv('IO_MAX_WORKERS', '8'))
+    
+    # Bulk loads with at least this many chunks pause index refresh while
+    # they run (refresh_interval=-1, async translog), then restore defaults
+    BULK_TUNING_MIN_ACTIONS = int(os.getenv('BULK_TUNING_MIN_ACTIONS', '1000'))
+    
+    # Maximum seconds to wait for text extraction from one uploaded file
+    EXTRACTION_TIMEOUT = int(os.getenv('EXTRACTION_TIMEOUT', '120'))
+    
+    # Text extraction processes per web worker (each gunicorn worker has its own pool)
+    EXTRACTION_MAX_WORKERS = int(os.getenv('EXTRACTION_MAX_WORKERS', '2'))
+    
+    # Worker threads for background document ingestion (async uploads)
+    INGEST_MAX_WORKERS = int(os.getenv('INGEST_MAX_WORKERS', '4'))
+    
+    # Background uploads accepted at once per process (queued + running)
+    # Each holds its file in memory, so further uploads get a 503 until one finishes
+    MAX_PENDING_INGESTS = int(os.getenv('MAX_PENDING_INGESTS', '16'))
+    
+    # ============================================
+    # CACHE SETTINGS
+    # ============================================
+    
+    # Redis URL for caching search results and AI answers (optional)
+    # Format: redis://localhost:6379/0 - leave empty to disable caching
+    REDIS_URL = os.getenv('REDIS_URL')
+    
+    # Seconds to wait when connecting to or reading from Redis
+    # Kept short: on timeout the app just skips the cache
+    REDIS_TIMEOUT = float(os.getenv('REDIS_TIMEOUT', '0.5'))
+    
+    # How long (seconds) cached search results stay valid
+    SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', '600'))
+    
+    # How long (seconds) cached AI answers stay valid
+    ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '3600'))
+    
+    # How long (seconds) cached chunk embeddings stay valid
+    EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', '604800'))
+    
+    # How long (seconds) the /api/health Elasticsearch probe is reused
+    HEALTH_CACHE_TTL = int(os.getenv('HEALTH_CACHE_TTL', '5'))
+    
+    # How long (seconds) background upload status is kept in Redis
+    UPLOAD_STATUS_TTL = int(os.getenv('UPLOAD_STATUS_TTL', '86400'))
+    
     # ============================================
     # NOTIFICATION SETTINGS
     # ============================================
@@ -113,12 +230,7 @@ class Config:
     # Enable email notifications (requires SendGrid)
     EMAIL_ENABLED = os.getenv('EMAIL_ENABLED', 'False').lower() == 'true'
     
-    # SendGrid API key (optional, for email alerts)
-    # Only needed if EMAIL_ENABLED = True
-    SENDGRID_API_KEY = os.getenv('SENDGRID_API_KEY')
-    
-    # Default sender email for notifications
-    FROM_EMAIL = os.getenv('FROM_EMAIL', 'noreply@opensquare.app')
+    # SENDGRID_API_KEY and FROM_EMAIL are loaded lazily (see LAZY_SETTINGS)
     
     # ============================================
     # VALIDATION & HELPER METHODS
@@ -185,14 +297,14 @@ class Config:
             if Config.allowed_file('budget.pdf'):
                 print("PDF allowed")
         """
-        return '.' in filename and \
-               filename.rsplit('.', 1)[1].lower() in cls.ALLOWED_EXTENSIONS
+        return filename[filename.rfind('.'):].lower() in cls._ALLOWED_DOT_EXT
     
     @classmethod
     def get_config_summary(cls):
         """
         Get a summary of current configuration (for debugging).
         Hides sensitive values like API keys.
+        Returns a new dict on each call; app.py builds it once as CONFIG_SUMMARY.
         
         Returns:
             dict: Configuration summary with sensitive values masked
@@ -209,3 +321,13 @@ class Config:
             'email_enabled': cls.EMAIL_ENABLED,
             'elastic_api_key': '***HIDDEN***' if cls.ELASTIC_API_KEY else 'NOT SET'
         }
+
+
+# Plain snapshot of all eagerly loaded Config settings, resolved once at import.
+# Use CFG.<SETTING> on hot paths; use Config for the helper methods
+# and for the LAZY_SETTINGS (e.g. Config.FROM_EMAIL).
+CFG = SimpleNamespace(**{
+    name: getattr(Config, name)
+    for name in dir(Config)
+    if name.isupper() and not name.startswith('_')
+})
@@ -6,47 +6,75 @@ Run this file to start the Flask backend server
 
 import os
 import sys
-from dotenv import load_dotenv
+from _env_bootstrap import ensure_env
 
 # Load environment variables
-load_dotenv()
+ensure_env()
 
 # Import Flask app
 from app import app
-from config import Config
-
-print("\n" + "="*60)
-print("🚀 OpenSquare Backend Starting")
-print("="*60 + "\n")
-
-# Validate configuration
-try:
-    Config.validate()
-    print("✅ Configuration validated successfully\n")
-except ValueError as e:
-    print(f"❌ Configuration Error: {str(e)}")
-    sys.exit(1)
-
-# Show config
-print("📋 Configuration Summary:")
-config_summary = Config.get_config_summary()
-for key, value in config_summary.items():
-    print(f"    {key}: {value}")
-print()
-
-# Run the app
-if __name__ == '__main__':
+from config import Config, CFG
+
+
+def validate_and_report():
+    """Validate configuration and print the startup summary (exits on errors)"""
+    print("\n" + "="*60)
+    print("🚀 OpenSquare Backend Starting")
+    print("="*60 + "\n")
+    
+    # Validate configuration
+    try:
+        Config.validate()
+        print("✅ Configuration validated successfully\n")
+    except ValueError as e:
+        print(f"❌ Configuration Error: {str(e)}")
+        sys.exit(1)
+    
+    # Show config
+    print("📋 Configuration Summary:")
+    config_summary = Config.get_config_summary()
+    for key, value in config_summary.items():
+        print(f"    {key}: {value}")
+    print()
+
+
+def main():
+    """Validate configuration and run the server"""
+    validate_and_report()
+    
     host = os.getenv('FLASK_HOST', '0.0.0.0')
     port = int(os.getenv('FLASK_PORT', 5000))
-    debug = Config.FLASK_DEBUG
+    debug = CFG.FLASK_DEBUG
     
     print(f"🌐 Server starting on http://{host}:{port}")
-    print(f"📊 Environment: {Config.FLASK_ENV}")
+    print(f"📊 Environment: {CFG.FLASK_ENV}")
     print(f"🔧 Debug mode: {debug}\n")
     
+    # Production: replace this process with gunicorn (WEB_CONCURRENCY workers,
+    # threaded workers, app imported once before forking)
+    if Config.is_production():
+        try:
+            os.execvp('gunicorn', [
+                'gunicorn',
+                '--workers', str(CFG.WEB_CONCURRENCY),
+                '--worker-class', 'gthread',
+                '--threads', '8',
+                '--preload',
+                '--bind', f'{host}:{port}',
+                'app:app'
+            ])
+        except FileNotFoundError:
+            print("❌ gunicorn is not installed. Run: pip install -r requirements.txt")
+            sys.exit(1)
+    
     app.run(
         host=host,
         port=port,
         debug=debug,
         use_reloader=debug
     )
+
+
+# Run the app (importing this module only exposes `app`; it does not start anything)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+OpenSquare .env Compiler
+Turns backend/.env into backend/env_compiled.py for deployments
+
+The generated module holds each setting as a plain constant, so startup
+imports it from the bytecode cache instead of parsing .env text.
+Re-run this script whenever .env changes.
+
+Usage:
+    python scripts/compile_env.py [path/to/.env] [path/to/env_compiled.py]
+"""
+
+import os
+import sys
+from dotenv import dotenv_values
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def compile_env(env_path: str, output_path: str) -> int:
+    """
+    Write every key/value pair from env_path as a module constant.
+    
+    Returns:
+        int: Number of settings written
+    """
+    values = {key: value for key, value in dotenv_values(env_path).items() if value is not None}
+    
+    lines = [
+        '"""',
+        'Compiled environment settings (generated by scripts/compile_env.py)',
+        'Do not edit or commit - regenerate from .env instead',
+        '"""',
+        '',
+    ]
+    lines.extend(f"{key} = {value!r}" for key, value in values.items())
+    
+    with open(output_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    return len(values)
+
+
+if __name__ == '__main__':
+    env_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(BACKEND_DIR, '.env')
+    output_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(BACKEND_DIR, 'env_compiled.py')
+    
+    count = compile_env(env_path, output_path)
+    print(f"✅ Wrote {count} settings to {output_path}")
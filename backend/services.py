@@ -0,0 +1,99 @@
+"""
+OpenSquare Service Clients
+Shared Vertex AI, Elasticsearch, Cloud Storage and Redis clients
+Each client is created once per process, on first use
+"""
+
+from functools import lru_cache
+from typing import Optional
+
+from config import Config
+
+# Import Google Cloud libraries
+from google.cloud import storage
+from vertexai.generative_models import GenerativeModel
+from vertexai.language_models import TextEmbeddingModel
+import vertexai
+
+# Import Elasticsearch
+from elasticsearch import Elasticsearch
+
+# orjson is optional; the client's stdlib JSON serializer is used without it
+# (elasticsearch-py only defines OrjsonSerializer when orjson is installed)
+try:
+    from elasticsearch.serializer import OrjsonSerializer
+except ImportError:
+    OrjsonSerializer = None
+
+
+@lru_cache(maxsize=1)
+def init_vertex_ai() -> None:
+    """Initialize Vertex AI (Google Cloud's AI platform) once"""
+    vertexai.init(
+        project=Config.GOOGLE_CLOUD_PROJECT,
+        location=Config.VERTEX_AI_LOCATION
+    )
+
+
+@lru_cache(maxsize=1)
+def get_gemini_model(system_instruction: Optional[str] = None) -> GenerativeModel:
+    """Gemini model for conversational AI"""
+    init_vertex_ai()
+    return GenerativeModel(
+        Config.VERTEX_AI_MODEL,
+        system_instruction=system_instruction
+    )
+
+
+@lru_cache(maxsize=1)
+def get_embedding_model() -> TextEmbeddingModel:
+    """Embedding model used to vectorize document chunks"""
+    init_vertex_ai()
+    return TextEmbeddingModel.from_pretrained(Config.VERTEX_AI_EMBEDDING_MODEL)
+
+
+@lru_cache(maxsize=1)
+def get_elastic_client() -> Elasticsearch:
+    """Elasticsearch client for document search (pooled keep-alive connections)"""
+    options = {}
+    if OrjsonSerializer is not None:
+        options['serializer'] = OrjsonSerializer()
+    
+    return Elasticsearch(
+        cloud_id=Config.ELASTIC_CLOUD_ID,
+        api_key=Config.ELASTIC_API_KEY,
+        connections_per_node=25,
+        http_compress=True,
+        request_timeout=30,
+        retry_on_timeout=True,
+        max_retries=3,
+        **options
+    )
+
+
+@lru_cache(maxsize=1)
+def get_storage_client() -> storage.Client:
+    """Google Cloud Storage client for file uploads"""
+    return storage.Client(project=Config.GOOGLE_CLOUD_PROJECT)
+
+
+@lru_cache(maxsize=1)
+def get_redis_client():
+    """
+    Redis result cache (None when REDIS_URL is unset or unusable)
+    Short socket timeouts keep an unreachable Redis from stalling requests
+    """
+    if not Config.REDIS_URL:
+        return None
+    try:
+        import redis
+        return redis.Redis.from_url(
+            Config.REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=Config.REDIS_TIMEOUT,
+            socket_timeout=Config.REDIS_TIMEOUT
+        )
+    except (ImportError, ValueError) as e:
+        # Cached like the client, so this is reported once per process
+        print(f"Redis caching disabled: {str(e)}")
+        return None
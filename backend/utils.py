@@ -1,17 +1,31 @@
 import os
 import re
+import hashlib
+import math
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import lru_cache
 import pandas as pd
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from io import BytesIO
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
 from datetime import datetime # <<< THIS IS THE CRITICAL MISSING IMPORT
 
 # --- Third-Party PDF Library (requires installation) ---
-# NOTE: We use pypdf for simplicity in this hackathon environment.
+# pypdfium2 (bindings to the PDFium C++ library) is preferred when installed;
+# pure-Python pypdf is the fallback.
 from pypdf import PdfReader 
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+from openpyxl import load_workbook
 
 # Import configuration
-from config import Config
+from config import CFG
 
 # ==============================================================================
 # 1. ELASTICSEARCH SETUP & INDEX MAPPING
@@ -27,7 +41,7 @@ def create_index_if_not_exists(elastic_client: Elasticsearch, index_name: str) -
     
     Args:
         elastic_client: The initialized Elasticsearch client instance.
-        index_name: The name of the index to create (from Config.ELASTIC_INDEX_NAME).
+        index_name: The name of the index to create (from Config.ELASTIC_CHUNKS_INDEX).
     
     Returns:
         True if the index was created or already exists, False otherwise.
@@ -43,6 +57,8 @@ def create_index_if_not_exists(elastic_client: Elasticsearch, index_name: str) -
                     "source_filename": {"type": "keyword"},
                     "source_url": {"type": "keyword", "index": False}, # Do not index the URL
                     "chunk_id": {"type": "keyword"}, # Unique identifier for the chunk
+                    "organization": {"type": "keyword"}, # kNN pre-filter fields
+                    "year": {"type": "integer"},
                     "text": {
                         "type": "text",
                         "analyzer": "english" # Use the English analyzer for better full-text search
@@ -50,8 +66,11 @@ def create_index_if_not_exists(elastic_client: Elasticsearch, index_name: str) -
                     "vector": {
                         "type": "dense_vector",
                         "dims": 768, # Dimensionality for text-embedding-004 (768)
+                        "element_type": "float", # Embeddings are sent as floats...
                         "index": True,
-                        "similarity": "cosine" # Use cosine similarity for vector search
+                        "similarity": "dot_product", # Vectors are L2-normalized at index time
+                        # ...and scalar-quantized to int8 inside HNSW: ~4x less vector memory
+                        "index_options": {"type": "int8_hnsw", "m": 16, "ef_construction": 100}
                     },
                     "timestamp": {"type": "date"}
                 }
@@ -84,6 +103,105 @@ def create_index_if_not_exists(elastic_client: Elasticsearch, index_name: str) -
         print(f"Error creating index: {e}")
         return False
 
+# Bulk loads currently running per index (guarded by _bulk_loads_lock), so that
+# concurrent uploads share one relaxed-settings window instead of undoing each other
+_bulk_loads: Dict[str, int] = {}
+_bulk_loads_lock = threading.Lock()
+
+@contextmanager
+def bulk_indexing_settings(elastic_client: Elasticsearch, index_name: str):
+    """
+    Temporarily relaxes refresh and translog durability on an index while a
+    large bulk load runs, then resets both to the index defaults.
+
+    Nested and concurrent loads in this process are reference-counted: only the
+    first one to enter relaxes the settings, and only the last one to leave
+    restores them. Failing to change settings (e.g. on serverless projects)
+    never blocks the load itself; it just runs with the normal settings.
+    
+    Usage:
+        with bulk_indexing_settings(elastic_client, index_name):
+            helpers.bulk(...)
+    """
+    with _bulk_loads_lock:
+        active = _bulk_loads.get(index_name, 0)
+        _bulk_loads[index_name] = active + 1
+        if active == 0:
+            try:
+                elastic_client.indices.put_settings(
+                    index=index_name,
+                    settings={"index": {"refresh_interval": "-1", "translog.durability": "async"}}
+                )
+            except Exception as e:
+                print(f"Could not relax index settings for bulk load: {e}")
+
+    try:
+        yield
+    finally:
+        with _bulk_loads_lock:
+            _bulk_loads[index_name] -= 1
+            if _bulk_loads[index_name] == 0:
+                del _bulk_loads[index_name]
+                try:
+                    # None resets each setting to the Elasticsearch default (1s / request)
+                    elastic_client.indices.put_settings(
+                        index=index_name,
+                        settings={"index": {"refresh_interval": None, "translog.durability": None}}
+                    )
+                    elastic_client.indices.refresh(index=index_name)
+                except Exception as e:
+                    print(f"Could not restore settings on '{index_name}' after bulk load "
+                          f"(refresh may still be disabled): {e}")
+
+def bulk_index_chunks(elastic_client: Elasticsearch, chunks: List[Dict[str, Any]],
+                      batch: int = 128, max_batch: int = 1024) -> int:
+    """
+    Bulk-indexes embedded chunks into the chunks index with streaming_bulk.
+
+    The batch size adapts as the load runs: it doubles (up to max_batch) after a
+    window indexes cleanly and halves (down to the starting size) after failures,
+    so large uploads quickly reach big, efficient requests without overloading
+    a struggling cluster.
+
+    Returns:
+        The number of chunks indexed successfully.
+    """
+    min_batch = batch
+    indexed = 0
+    pos = 0
+    while pos < len(chunks):
+        window = chunks[pos:pos + batch]
+        actions = (
+            {"_index": CFG.ELASTIC_CHUNKS_INDEX, "_id": chunk["chunk_id"], "_source": chunk}
+            for chunk in window
+        )
+        failed = 0
+        first_error = None
+        for ok, item in helpers.streaming_bulk(
+            elastic_client,
+            actions,
+            chunk_size=batch,
+            max_chunk_bytes=10 * 1024 * 1024,
+            raise_on_error=False,
+            raise_on_exception=False
+        ):
+            if ok:
+                indexed += 1
+            else:
+                failed += 1
+                # Items can carry the whole chunk (vector included) under 'data',
+                # so only the id, status and error of the first failure are kept
+                if first_error is None:
+                    info = next(iter(item.values()), {})
+                    first_error = (info.get("_id"), info.get("status"), info.get("error"))
+        if failed:
+            chunk_id, status, error = first_error
+            print(f"Error indexing {failed} of {len(window)} chunks "
+                  f"(first: {chunk_id}, status {status}: {error})")
+        pos += len(window)
+        batch = max(batch // 2, min_batch) if failed else min(batch * 2, max_batch)
+    return indexed
+
 # ==============================================================================
 # 2. FILE EXTRACTION UTILITIES
 # ==============================================================================
@@ -91,18 +209,40 @@ def create_index_if_not_exists(elastic_client: Elasticsearch, index_name: str) -
 def extract_text_from_pdf(file_stream: BytesIO) -> str:
     """Extracts text from a PDF file stream."""
     try:
+        if pdfium is not None:
+            return _extract_text_with_pdfium(file_stream)
+
         reader = PdfReader(file_stream)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n\n"
-        return text
+        # Collect pages and join once (extract_text() may return None)
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return ""
 
+def _extract_text_with_pdfium(file_stream: BytesIO) -> str:
+    """Extracts text with PDFium, where layout and text decoding run in native code."""
+    pdf = pdfium.PdfDocument(file_stream)
+    try:
+        parts = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return "\n\n".join(parts)
+    finally:
+        pdf.close()
+
 def extract_data_from_excel(file_stream: BytesIO) -> str:
     """Extracts data from all sheets in an Excel file stream and returns it as a concatenated string."""
     try:
+        # .xlsx files are zip archives; stream their rows without building DataFrames
+        is_xlsx = file_stream.read(2) == b"PK"
+        file_stream.seek(0)
+        if is_xlsx:
+            return _extract_rows_from_xlsx(file_stream)
+
+        # Legacy .xls workbooks still go through pandas
         xls = pd.ExcelFile(file_stream)
         all_data = []
         for sheet_name in xls.sheet_names:
@@ -114,51 +254,154 @@ def extract_data_from_excel(file_stream: BytesIO) -> str:
         print(f"Error extracting data from Excel: {e}")
         return ""
 
+def _extract_rows_from_xlsx(file_stream: BytesIO) -> str:
+    """Dumps every sheet of an .xlsx workbook as tab-separated rows, one row in memory at a time."""
+    workbook = load_workbook(file_stream, read_only=True, data_only=True)
+    try:
+        return "\n\n".join(
+            f"---Sheet: {sheet.title}---\n" + "\n".join(
+                "\t".join("" if value is None else str(value) for value in row)
+                for row in sheet.iter_rows(values_only=True)
+            )
+            for sheet in workbook.worksheets
+        )
+    finally:
+        workbook.close()
+
 def extract_data_from_csv(file_stream: BytesIO) -> str:
-    """Extracts data from a CSV file stream and returns it as a single string."""
+    """
+    Extracts data from a CSV file stream and returns it as a single string.
+    The CSV is already text, so the raw bytes are decoded as-is rather than
+    parsed into a DataFrame and re-formatted (utf-8-sig drops a leading BOM).
+    """
     try:
-        df = pd.read_csv(file_stream)
-        return df.to_string(index=False)
+        return file_stream.read().decode('utf-8-sig', errors='ignore')
     except Exception as e:
         print(f"Error extracting data from CSV: {e}")
         return ""
 
+def _extract_from_bytes(file_bytes: bytes, file_ext: str) -> str:
+    """Runs the extractor for file_ext on raw bytes (executed inside a worker process)."""
+    file_stream = BytesIO(file_bytes)
+    if file_ext == 'pdf':
+        return extract_text_from_pdf(file_stream)
+    if file_ext in ('xlsx', 'xls'):
+        return extract_data_from_excel(file_stream)
+    if file_ext == 'csv':
+        return extract_data_from_csv(file_stream)
+    return ""
+
+@lru_cache(maxsize=1)
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """
+    Worker processes for text extraction (created on first use in each process).
+
+    Workers are started from a clean forkserver (spawn where unavailable) rather
+    than forked from the web worker, which may hold live threads, gRPC and
+    HTTP connection state. EXTRACTION_MAX_WORKERS caps the pool per web worker.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=CFG.EXTRACTION_MAX_WORKERS, mp_context=context)
+
+# Serializes discarding the cached extraction pool across request threads
+_extraction_pool_lock = threading.Lock()
+
+def _discard_extraction_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    Kills a broken or stuck extraction pool so the next call builds a fresh one.
+
+    ProcessPoolExecutor cannot cancel a running task, so the workers are
+    terminated directly; otherwise a hung file would hold its worker forever.
+    Tasks still running on the old pool fail with BrokenProcessPool.
+    """
+    with _extraction_pool_lock:
+        if get_extraction_pool.cache_info().currsize and get_extraction_pool() is pool:
+            get_extraction_pool.cache_clear()
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def extract_text(file_bytes: bytes, file_ext: str, timeout: float) -> str:
+    """
+    Extracts text from an uploaded file in the extraction process pool.
+
+    Raw bytes are sent to the worker (cheap to pickle) and wrapped in a BytesIO
+    there, so parsing several uploads at once uses several cores instead of
+    contending for the GIL.
+
+    If a worker dies (e.g. a native PDFium crash or an OOM kill) the pool is
+    rebuilt and the file is retried once. On timeout the pool is recycled so
+    the stuck worker does not keep a slot, and the TimeoutError is re-raised.
+
+    Returns:
+        The extracted text.
+    """
+    for attempt in range(2):
+        pool = get_extraction_pool()
+        try:
+            return pool.submit(_extract_from_bytes, file_bytes, file_ext).result(timeout=timeout)
+        except BrokenProcessPool:
+            _discard_extraction_pool(pool)
+            if attempt:
+                raise
+        except FutureTimeoutError:
+            _discard_extraction_pool(pool)
+            raise
+
 # ==============================================================================
 # 3. TEXT PROCESSING UTILITIES
 # ==============================================================================
 
+# Runs of two or more whitespace characters (compiled once, used per upload)
+_WHITESPACE_RUN_RE = re.compile(r'\s{2,}')
+
 def clean_text(text: str) -> str:
     """Performs basic cleanup on extracted text."""
     # Remove excessive newlines/spaces
-    text = re.sub(r'\s{2,}', ' ', text)
-    # Remove non-ASCII characters and leading/trailing whitespace
-    text = text.encode('ascii', 'ignore').decode('ascii').strip()
-    return text
+    text = _WHITESPACE_RUN_RE.sub(' ', text)
+    # Remove non-ASCII characters (isascii() is O(1), so pure-ASCII text skips
+    # the encode/decode copies) and leading/trailing whitespace
+    if not text.isascii():
+        text = text.encode('ascii', 'ignore').decode('ascii')
+    return text.strip()
+
+# Chunking limits (in characters)
+_MAX_PARAGRAPH_CHARS = 2000  # Longer paragraphs switch to fixed-size windows
+_WINDOW_CHARS = 1500         # Fixed window size for the fallback
+_MIN_CHUNK_CHARS = 50        # Smaller chunks are skipped
+
+def _iter_paragraphs(text: str):
+    """Yields stripped, non-empty paragraphs (split on blank lines) without building a list."""
+    pos = 0
+    while True:
+        end = text.find('\n\n', pos)
+        section = (text[pos:] if end == -1 else text[pos:end]).strip()
+        if section:
+            yield section
+        if end == -1:
+            return
+        pos = end + 2
+
+def _iter_windows(text: str):
+    """Yields stripped, non-empty fixed-size slices of the text."""
+    for i in range(0, len(text), _WINDOW_CHARS):
+        section = text[i:i + _WINDOW_CHARS].strip()
+        if section:
+            yield section
 
-def chunk_text(text: str, document_id: str, source_filename: str, source_url: str) -> List[Dict[str, Any]]:
+def chunk_text(text: str, document_id: str, source_filename: str, source_url: str,
+               timestamp: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Splits long text into smaller, manageable chunks suitable for RAG and indexing.
     This creates the structure of the document that is saved in Elasticsearch.
+    Pass the document's upload timestamp to reuse it for every chunk.
     """
-    # Simple chunking for demonstration: splitting by paragraph/double newline
-    sections = [s.strip() for s in text.split('\n\n') if s.strip()]
-    
-    # Fallback for very large sections or uniform text (e.g., from tables)
-    if not sections or max(len(s) for s in sections) > 2000:
-        # If splitting by paragraph is ineffective, chunk by a fixed size
-        sections = [text[i:i + 1500] for i in range(0, len(text), 1500)]
-        sections = [s.strip() for s in sections if s.strip()]
-
-    chunks = []
-    
     # Timestamp is constant for all chunks of the same document
-    current_time = datetime.now().isoformat()
-    
-    for i, chunk_text in enumerate(sections):
-        if len(chunk_text) < 50:
-            continue # Skip very small chunks
-            
-        chunk_data = {
+    current_time = timestamp or datetime.now().isoformat()
+
+    def make_chunk(i: int, chunk_text: str) -> Dict[str, Any]:
+        return {
             "document_id": document_id,
             "source_filename": source_filename,
             "source_url": source_url,
@@ -168,42 +411,121 @@ def chunk_text(text: str, document_id: str, source_filename: str, source_url: st
             # NOTE: The 'vector' field will be added later in app.py 
             # after the text has been sent to the Vertex AI embedding model.
         }
-        chunks.append(chunk_data)
-        
-    return chunks
+
+    # Simple chunking for demonstration: splitting by paragraph/double newline,
+    # building chunks in the same pass (very small sections are skipped)
+    chunks = []
+    count = 0
+    for count, section in enumerate(_iter_paragraphs(text), 1):
+        if len(section) > _MAX_PARAGRAPH_CHARS:
+            break
+        if len(section) >= _MIN_CHUNK_CHARS:
+            chunks.append(make_chunk(count - 1, section))
+    else:
+        if count:
+            return chunks
+
+    # Fallback for very large sections or uniform text (e.g., from tables):
+    # if splitting by paragraph is ineffective, chunk by a fixed size
+    return [
+        make_chunk(i, section)
+        for i, section in enumerate(_iter_windows(text))
+        if len(section) >= _MIN_CHUNK_CHARS
+    ]
+
+def generate_document_id(filename: str, timestamp: str) -> str:
+    """Creates a stable, unique document ID from the filename and upload time."""
+    return hashlib.sha256(f"{filename}_{timestamp}".encode()).hexdigest()[:16]
+
+def format_file_size(size_bytes: int) -> str:
+    """Formats a byte count as a human-readable size (e.g. '2.4 MB')."""
+    size = float(size_bytes)
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
 
 # ==============================================================================
 # 4. ELASTICSEARCH RAG SEARCH UTILITY
 # ==============================================================================
 
-def search_documents(query_embedding: List[float], size: int = 5) -> List[Dict[str, Any]]:
+# Metadata fields that /api/query may filter kNN candidates on
+KNN_FILTER_FIELDS = ("organization", "year")
+
+# Chunk fields returned by kNN search (the stored vector is never needed)
+KNN_SOURCE_FIELDS = ["document_id", "chunk_id", "source_filename", "source_url", "text", "organization", "year"]
+
+def normalize_vector(vector: List[float]) -> List[float]:
+    """Scales a vector to unit length so 'dot_product' similarity can be used."""
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+def _build_knn_query(query_embedding: List[float], size: int,
+                     filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Builds the kNN clause for one query vector, with optional metadata pre-filter."""
+    knn = {
+        "field": "vector",
+        "query_vector": query_embedding,
+        "k": size,
+        # HNSW candidates per shard; more improves recall but costs more scoring
+        "num_candidates": max(50, size * 10),
+    }
+
+    terms = [{"term": {field: value}} for field, value in (filters or {}).items()
+             if field in KNN_FILTER_FIELDS and value not in (None, "")]
+    if terms:
+        knn["filter"] = {"bool": {"filter": terms}}
+    return knn
+
+def search_documents_batch(elastic_client: Elasticsearch, query_embeddings: List[List[float]], size: int = 5,
+                           filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
     """
-    Performs a k-nearest neighbor (kNN) search against the 'vector' field 
-    to retrieve the most semantically relevant text chunks for RAG.
+    Runs one kNN search per query embedding in a single _msearch request.
+
+    Returns:
+        One result list per query embedding, in the same order.
     """
-    # NOTE: This assumes 'get_elastic_client()' is available or defined in app.py.
-    # We will redefine the client usage in app.py for simplicity.
-    
-    # For now, we will assume the client is imported globally in app.py and 
-    # that this function is only called from within the Flask request context where it can be passed.
-    # The actual client object must be passed here for this function to work outside app.py.
-    # Since this is a utility file, let's keep the client out of it and assume it's passed or imported globally in app.py.
-    # I will fix this dependency issue in the final app.py file to ensure it runs smoothly.
-    
-    # For the immediate fix: Commenting out the dependency on a non-existent function for now.
-    # elastic_client = get_elastic_client() 
-    
-    print("Warning: `search_documents` function requires the `elastic_client` to be passed or accessible.")
+    searches = []
+    for query_embedding in query_embeddings:
+        searches.append({"index": CFG.ELASTIC_CHUNKS_INDEX})
+        searches.append({
+            "knn": _build_knn_query(query_embedding, size, filters),
+            "size": size,
+            "_source": KNN_SOURCE_FIELDS,
+        })
 
-    # --- Start of Search Logic ---
-    # The actual client object will be needed here to run the search.
-    # For now, we'll keep the logic as-is, with the understanding that the call 
-    # to this function in app.py will need to pass the client:
-    # `search_documents(elastic_client, query_embedding, size=Config.RAG_TOP_K)`
-    
-    # NOTE: Since the client is initialized in app.py and not utils.py, 
-    # the function signature will need to be updated in the next step when we write app.py.
-    # For now, let's just make the immediate datetime import fix.
-    
-    return [] # Returning an empty list for now until app.py is written
+    try:
+        response = elastic_client.msearch(
+            searches=searches,
+            # 'status' keeps every response in the list so results stay aligned
+            filter_path=["responses.status", "responses.error", "responses.hits.hits._score",
+                         "responses.hits.hits._source"]
+        )
+        results = []
+        for item in response.body.get("responses", []):
+            # A failed search comes back as an error entry with no hits
+            if "error" in item:
+                print(f"Error running kNN search: {item['error']}")
+                results.append([])
+                continue
+            hits = item.get("hits", {}).get("hits", [])
+            results.append([{**hit["_source"], "score": hit["_score"]} for hit in hits])
+        # Missing responses count as no hits, so there is always one list per query
+        results.extend([] for _ in range(len(query_embeddings) - len(results)))
+        return results
+    except Exception as e:
+        print(f"Error running kNN search: {e}")
+        return [[] for _ in query_embeddings]
 
+def search_documents(elastic_client: Elasticsearch, query_embedding: List[float], size: int = 5,
+                     filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Performs a k-nearest neighbor (kNN) search against the 'vector' field 
+    to retrieve the most semantically relevant text chunks for RAG.
+
+    Optional metadata filters (organization, year) are applied as a kNN
+    pre-filter, so only matching chunks are scored.
+    """
+    results = search_documents_batch(elastic_client, [query_embedding], size, filters)
+    return results[0] if results else []